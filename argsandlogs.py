@@ -53,13 +53,17 @@ __version__ = '1.0.8'
 __date__ = 'May 22, 2020'
 
 from argparse import ArgumentParser
+import atexit
 import logging
 from logging import addLevelName, Formatter, StreamHandler
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueListener, TimedRotatingFileHandler
 from pathlib import Path
+from queue import Queue
 
 from . import colortext
 from .colortext import DATA, THREADDEBUG
+from .logformats import (LOG_FORMATS, BinaryFileHandler,
+                         DeferredQueueHandler, JsonFormatter)
 
 LOG = colortext.getLogger('Plugin')
 
@@ -73,6 +77,7 @@ class AL:
     parser = ArgumentParser()
     name = parser.prog.replace('.py', '')
     args = None
+    _listener = None
 
     @classmethod
     def start(cls, version=''):
@@ -89,6 +94,10 @@ class AL:
         cls.parser.add_argument('-L', '--log_directory',
                     default='/var/local/log',
                     help='top-level log directory (full pathname or relative)')
+        cls.parser.add_argument('-F', '--log_format', choices=LOG_FORMATS,
+                    default='text',
+                    help='log file format; json and binary formats defer '
+                         'message formatting to a writer thread')
         cls.args = cls.parser.parse_args()
 
         addLevelName(THREADDEBUG, 'THREADDEBUG')
@@ -105,22 +114,42 @@ class AL:
         LOG.threaddebug('AL.start called')
         if cls.args.log:
             dir_path = Path(cls.args.log_directory)
-            log_path = dir_path / Path(cls.name.lower() + '.log')
+            suffix = {'text': '.log', 'json': '.jsonl', 'binary': '.logb'}
+            log_path = dir_path / Path(cls.name.lower()
+                                       + suffix[cls.args.log_format])
             try:
                 dir_path.mkdir(parents=True, exist_ok=True)
-                log_handler = TimedRotatingFileHandler(log_path,
-                                                       when='midnight')
+                if cls.args.log_format == 'binary':
+                    log_handler = BinaryFileHandler(log_path, when='midnight')
+                else:
+                    log_handler = TimedRotatingFileHandler(log_path,
+                                                           when='midnight')
             except OSError as err:
                 warning = ('open error %s "%s" %s; log option ignored'
                            % (err.errno, log_path, err.strerror))
                 LOG.warning(warning)
                 cls.args.log = None
             else:
-                log_handler.setLevel(cls.args.log)
-                log_formatter = Formatter(
-                    '%(asctime)s %(levelname)s %(message)s')
-                log_handler.setFormatter(log_formatter)
-                cls._log.addHandler(log_handler)
+                if cls.args.log_format == 'text':
+                    log_handler.setLevel(cls.args.log)
+                    log_formatter = Formatter(
+                        '%(asctime)s %(levelname)s %(message)s')
+                    log_handler.setFormatter(log_formatter)
+                    cls._log.addHandler(log_handler)
+                else:
+
+                    # Enqueue unformatted records and format/write them in
+                    # the QueueListener thread.
+
+                    if cls.args.log_format == 'json':
+                        log_handler.setFormatter(JsonFormatter())
+                    queue_handler = DeferredQueueHandler(Queue())
+                    queue_handler.setLevel(cls.args.log)
+                    cls._listener = QueueListener(queue_handler.queue,
+                                                  log_handler)
+                    cls._listener.start()
+                    cls._log.addHandler(queue_handler)
+                    atexit.register(cls._stop_listener)
 
         if version:
             version = ' v' + version
@@ -135,3 +164,15 @@ class AL:
         # Log main program stopping message.
 
         LOG.blue('stopping %s', cls.name)
+
+        cls._stop_listener()
+
+    @classmethod
+    def _stop_listener(cls):
+        """
+        Flush any queued log records and stop the log writer thread.  Called
+        by stop and also at exit in case the main program does not call stop.
+        """
+        if cls._listener:
+            cls._listener.stop()
+            cls._listener = None
@@ -0,0 +1,183 @@
+"""
+ PACKAGE:  papamac's common module library (papamaclib)
+  MODULE:  logformats.py
+   TITLE:  compact structured log file formats (logformats)
+FUNCTION:  logformats provides JSON-lines and length-prefixed binary log file
+           formats for high-volume logging (e.g., DATA records), a queue
+           handler that defers message interpolation to a writer thread, and
+           a memory-mapped reader that streams log files back for analysis.
+   USAGE:  logformats is used by argsandlogs when the --log_format option is
+           json or binary.  read_log may be imported by analysis programs.  It
+           is compatible with all versions of Python 3.x.
+  AUTHOR:  papamac
+ VERSION:  1.0.0
+    DATE:  October 19, 2026
+
+
+MIT LICENSE:
+
+Copyright (c) 2019-2026 David A. Krause, aka papamac
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+DESCRIPTION:
+
+JSON-lines files contain one JSON object per line with keys t (record creation
+time in seconds since the epoch), level (level name), and msg (the fully
+interpolated message, followed by any exception traceback and stack text).
+
+Binary files contain a sequence of length-prefixed records.  Each record is a
+little-endian uint32 length (the number of bytes that follow), a float64
+creation time, a uint8 level number, and the UTF-8 encoded message (including
+any exception traceback and stack text).
+
+DEPENDENCIES/LIMITATIONS:
+
+Deferred interpolation passes the record arguments to the writer thread by
+reference.  Arguments that are mutated after the logging call will be logged
+with their mutated values.
+
+"""
+
+__author__ = 'papamac'
+__version__ = '1.0.0'
+__date__ = 'October 19, 2026'
+
+from json import dumps, loads
+from logging import Formatter, getLevelName
+from logging.handlers import QueueHandler, TimedRotatingFileHandler
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+
+# Global constants:
+
+LOG_FORMATS = ('text', 'json', 'binary')    # --log_format choices.
+BIN_LEN = Struct('<I')                  # Binary record length prefix.
+BIN_HDR = Struct('<dB')                 # Binary record time and level.
+
+
+def _full_message(formatter, record):
+    """
+    Return the interpolated record message followed by any exception
+    traceback and stack information text, as logging.Formatter.format does.
+    """
+    message = record.getMessage()
+    if record.exc_info and not record.exc_text:
+        record.exc_text = formatter.formatException(record.exc_info)
+    if record.exc_text:
+        message += '\n' + record.exc_text
+    if record.stack_info:
+        message += '\n' + formatter.formatStack(record.stack_info)
+    return message
+
+
+class JsonFormatter(Formatter):
+    """
+    Format a log record as a single-line JSON object.
+    """
+
+    def format(self, record):
+        return dumps({'t': record.created, 'level': record.levelname,
+                      'msg': _full_message(self, record)},
+                     separators=(',', ':'))
+
+
+class BinaryFormatter(Formatter):
+    """
+    Format a log record as a length-prefixed binary record (bytes).
+    """
+
+    def format(self, record):
+        body = (BIN_HDR.pack(record.created, record.levelno)
+                + _full_message(self, record).encode())
+        return BIN_LEN.pack(len(body)) + body
+
+
+class BinaryFileHandler(TimedRotatingFileHandler):
+    """
+    Timed rotating file handler that writes the bytes returned by a
+    BinaryFormatter to a file opened in binary append mode.
+    """
+
+    def __init__(self, filename, when='midnight'):
+        TimedRotatingFileHandler.__init__(self, filename, when=when)
+        self.setFormatter(BinaryFormatter())
+
+    def _open(self):
+        return open(self.baseFilename, 'ab')
+
+    def emit(self, record):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record))
+            self.flush()
+        except Exception:
+            self.handleError(record)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queue handler that enqueues log records without formatting them so that
+    % interpolation is performed by the QueueListener (writer) thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def read_log(path, log_format='binary'):
+    """
+    Return an iterator of (created, levelname, message) tuples from a
+    JSON-lines or binary log file using memory-mapped I/O.  A truncated final
+    record (e.g., from a file that is still being written) is ignored.
+    log_format must be 'json' or 'binary'; text log files are not parsed.
+    """
+    if log_format not in LOG_FORMATS[1:]:  # json or binary.
+        raise ValueError('unsupported log format "%s"' % log_format)
+    return _read_records(path, log_format)
+
+
+def _read_records(path, log_format):
+    with open(path, 'rb') as file:
+        try:
+            mm = mmap(file.fileno(), 0, access=ACCESS_READ)
+        except ValueError:  # Empty file; nothing to read.
+            return
+    with mm:
+        if log_format == 'json':
+            for line in iter(mm.readline, b''):
+                if line.endswith(b'\n'):
+                    record = loads(line)
+                    yield record['t'], record['level'], record['msg']
+            return
+        offset = 0
+        size = len(mm)
+        while offset + BIN_LEN.size <= size:
+            length, = BIN_LEN.unpack_from(mm, offset)
+            offset += BIN_LEN.size
+            if offset + length > size:
+                break
+            created, levelno = BIN_HDR.unpack_from(mm, offset)
+            message = mm[offset + BIN_HDR.size:offset + length].decode()
+            offset += length
+            yield created, getLevelName(levelno), message
@@ -0,0 +1,218 @@
+"""
+ PACKAGE:  papamac's common module library (papamaclib)
+  MODULE:  messagecapture.py
+   TITLE:  messagesocket capture and replay (messagecapture)
+FUNCTION:  Provides classes to record raw messagesocket frames into an
+           append-only capture file and to replay them through a
+           MessageServer either at the original timing or as fast as
+           possible.
+   USAGE:  A MessageCapture object is passed to MessageSocket or MessageServer
+           (capture argument) to record received frames.  A MessageReplay
+           object's get_message method is passed to MessageServer
+           (get_message argument) to replay a capture file.  It is compatible
+           with all versions of Python 3.x.
+  AUTHOR:  papamac
+ VERSION:  1.0.0
+    DATE:  October 19, 2026
+
+
+MIT LICENSE:
+
+Copyright (c) 2018-2026 David A. Krause, aka papamac
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+DESCRIPTION:
+
+A capture file begins with a 16-byte file header: the magic bytes b'MSGCAP01',
+the little-endian uint32 message length (MSG_LEN), and four pad bytes.  The
+header is followed by fixed-length records, each consisting of a little-endian
+float64 arrival time and the raw MSG_LEN-byte frame.  Connection handshake
+frames and control (clock sync) frames are not captured.  The header and each
+record are flushed as they are written, so a capture file that is still being
+written (or whose writer crashed) can be replayed.
+
+Arrival times are capture clock times: seconds since the epoch from the
+monotonic messagesocket clock, which is anchored to the wall clock when
+messagesocket is imported.  The capture clock is not stepped by NTP, but over
+a long uptime it may drift from the wall clock, so arrival times (and the
+times passed to MessageReplay.find) are only approximately wall clock times.
+Because records are fixed-length and appended in arrival order, the records
+themselves form the arrival-time index: record i is at a computed offset and
+the record for a given time is found by binary search.
+
+DEPENDENCIES/LIMITATIONS:
+
+Capture files are read with mmap; only the records present when the
+MessageReplay object is created are replayed.
+
+"""
+
+__author__ = 'papamac'
+__version__ = '1.0.0'
+__date__ = 'October 19, 2026'
+
+from mmap import mmap, ACCESS_READ
+from os import fstat
+from struct import Struct
+from threading import Lock
+from time import sleep
+
+from .colortext import getLogger
+from .messagesocket import HDR_LEN, MSG_LEN, clock
+
+# Global constants:
+
+LOG = getLogger('Plugin')               # Color logger.
+MAGIC = b'MSGCAP01'                     # Capture file magic bytes.
+FILE_HDR = Struct('<8sI4x')             # Capture file header.
+ARRIVAL = Struct('<d')                  # Record arrival time.
+REC_LEN = ARRIVAL.size + MSG_LEN        # Fixed capture record length (bytes).
+
+
+class MessageCapture:
+    """
+    Append raw received frames and their arrival times to a capture file.
+    A single MessageCapture object may be shared by multiple MessageSockets.
+    Arrival times are taken from the monotonic messagesocket clock while
+    holding the file lock, so records are always in arrival-time order.
+    """
+
+    # Private methods:
+
+    def __init__(self, path):
+        LOG.threaddebug('MessageCapture.__init__ called "%s"', path)
+        self._path = path
+        self._lock = Lock()
+        self._file = open(path, 'ab')
+        if not self._file.tell():
+            self._file.write(FILE_HDR.pack(MAGIC, MSG_LEN))
+            self._file.flush()
+        self.records = 0
+
+    # Public methods:
+
+    def write(self, byte_msg):
+        with self._lock:
+            if self._file:
+                self._file.write(ARRIVAL.pack(clock()) + byte_msg)
+                self._file.flush()
+                self.records += 1
+
+    def close(self):
+        LOG.threaddebug('MessageCapture.close called "%s"', self._path)
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+        LOG.info('captured %i messages "%s"', self.records, self._path)
+
+
+class MessageReplay:
+    """
+    Memory-map a capture file and replay its messages.  The get_message
+    method is intended to be used as the MessageServer get_message callback.
+    speed is the replay speed relative to the original timing (e.g., 2.0 for
+    twice as fast); speed = 0.0 replays as fast as possible.
+    """
+
+    # Private methods:
+
+    def __init__(self, path, speed=1.0, loop=False):
+        LOG.threaddebug('MessageReplay.__init__ called "%s"', path)
+        self._path = path
+        self._speed = speed
+        self._loop = loop
+        with open(path, 'rb') as file:
+            if fstat(file.fileno()).st_size < FILE_HDR.size:
+                raise ValueError('invalid capture file "%s"' % path)
+            self._mm = mmap(file.fileno(), 0, access=ACCESS_READ)
+        magic, msg_len = FILE_HDR.unpack_from(self._mm)
+        if magic != MAGIC or msg_len != MSG_LEN:
+            self._mm.close()
+            raise ValueError('invalid capture file "%s"' % path)
+        self._len = (len(self._mm) - FILE_HDR.size) // REC_LEN
+        self._index = 0
+        self._start = None
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        """
+        Return the (arrival, byte_msg) tuple for a record.
+        """
+        if not 0 <= index < self._len:
+            raise IndexError('capture record index out of range')
+        offset = FILE_HDR.size + index * REC_LEN
+        arrival, = ARRIVAL.unpack_from(self._mm, offset)
+        offset += ARRIVAL.size
+        return arrival, self._mm[offset:offset + MSG_LEN]
+
+    def _arrival(self, index):
+        offset = FILE_HDR.size + index * REC_LEN
+        return ARRIVAL.unpack_from(self._mm, offset)[0]
+
+    # Public methods:
+
+    def find(self, arrival):
+        """
+        Return the index of the first record that arrived at or after the
+        specified capture clock time (see DESCRIPTION).
+        """
+        low, high = 0, self._len
+        while low < high:
+            mid = (low + high) // 2
+            if self._arrival(mid) < arrival:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def seek(self, index):
+        self._index = index
+        self._start = None
+
+    def get_message(self):
+        """
+        Return the next captured message without its header, waiting as
+        necessary to reproduce the original timing.  Return a null string
+        after the last record (unless looping).
+        """
+        if self._index >= self._len:
+            if not (self._loop and self._len):
+                sleep(1.0)  # Don't spin the MessageServer serve thread.
+                return ''
+            self.seek(0)
+        arrival, byte_msg = self[self._index]
+        if self._speed:
+            now = clock()
+            if self._start is None:
+                self._start = now, arrival
+            start, first = self._start
+            delay = start + (arrival - first) / self._speed - now
+            if delay > 0.0:
+                sleep(delay)
+        self._index += 1
+        return byte_msg[HDR_LEN:].decode(errors='replace').strip()
+
+    def close(self):
+        LOG.threaddebug('MessageReplay.close called "%s"', self._path)
+        self._mm.close()
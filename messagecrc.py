@@ -0,0 +1,107 @@
+"""
+ PACKAGE:  papamac's common module library (papamaclib)
+  MODULE:  messagecrc.py
+   TITLE:  messagesocket CRC functions (messagecrc)
+FUNCTION:  Provides the CRC functions that may be negotiated for messagesocket
+           message integrity checks: crc32 (binascii, the default) and crc32c
+           (Castagnoli).  crc32c uses the optional crc32c extension package
+           (hardware-accelerated on CPUs with SSE4.2 or ARMv8 CRC
+           instructions) if it is installed, and a pure Python table-driven
+           implementation otherwise.
+   USAGE:  messagecrc is imported by messagesocket.  All CRC functions have
+           the signature crc(data, value=0), accept any bytes-like object
+           (e.g., a memoryview slice), and may be applied incrementally by
+           passing the previous result as value.  It is compatible with all
+           versions of Python 3.x.
+  AUTHOR:  papamac
+ VERSION:  1.0.0
+    DATE:  October 19, 2026
+
+
+MIT LICENSE:
+
+Copyright (c) 2018-2026 David A. Krause, aka papamac
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+DESCRIPTION:
+
+The negotiated CRC is computed over the message header (excluding the CRC
+itself) and data, without trailing blanks, exactly as for crc32.  The CRC32C
+check value is crc32c(b'123456789') == 0xe3069283.
+
+DEPENDENCIES/LIMITATIONS:
+
+The pure Python crc32c fallback is roughly two orders of magnitude slower
+than binascii.crc32.  messagesocket therefore negotiates crc32c only when the
+crc32c extension package is installed on both hosts.
+
+"""
+
+__author__ = 'papamac'
+__version__ = '1.0.0'
+__date__ = 'October 19, 2026'
+
+from binascii import crc32
+
+try:
+    from crc32c import crc32c as _crc32c_ext  # Optional extension package.
+except ImportError:
+    _crc32c_ext = None
+
+# Global constants:
+
+CRC32C_POLY = 0x82f63b78                # Reversed Castagnoli polynomial.
+HARDWARE_CRC32C = _crc32c_ext is not None
+
+
+def _crc32c_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ CRC32C_POLY if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+CRC32C_TABLE = _crc32c_table()
+
+
+def crc32c_py(data, value=0):
+    """
+    Pure Python table-driven CRC32C.
+    """
+    table = CRC32C_TABLE
+    crc = value ^ 0xffffffff
+    for byte in bytes(data):
+        crc = table[(crc ^ byte) & 0xff] ^ (crc >> 8)
+    return crc ^ 0xffffffff
+
+
+crc32c = _crc32c_ext or crc32c_py
+
+CRC_FUNCTIONS = {'crc32': crc32, 'crc32c': crc32c}
+
+# CRCs that may be requested or acknowledged in messagesocket negotiation.
+# The pure Python crc32c is much slower than crc32, so crc32c is negotiated
+# only when the extension package is installed.
+
+NEGOTIABLE_CRCS = ('crc32', 'crc32c') if HARDWARE_CRC32C else ('crc32',)
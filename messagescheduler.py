@@ -0,0 +1,367 @@
+"""
+ PACKAGE:  papamac's common module library (papamaclib)
+  MODULE:  messagescheduler.py
+   TITLE:  MessageServer client rate limiting and scheduling (messagescheduler)
+FUNCTION:  Provides per-client token bucket rate limiting of inbound requests
+           and outbound messages, and weighted round-robin dispatching of
+           inbound requests to a bounded worker thread pool for MessageServer.
+   USAGE:  A ClientScheduler object is passed to MessageServer (scheduler
+           argument).  It is compatible with all versions of Python 3.x.
+  AUTHOR:  papamac
+ VERSION:  1.0.0
+    DATE:  October 19, 2026
+
+
+MIT LICENSE:
+
+Copyright (c) 2018-2026 David A. Krause, aka papamac
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+DESCRIPTION:
+
+Each client connection has a bounded inbound request queue and a bounded
+outbound message queue.  The client's recv thread appends requests to its
+inbound queue; when the queue is full the request is dropped and counted.  A
+dispatch thread visits the clients in round-robin order and moves up to weight
+requests per visit from each inbound queue to a bounded work queue, subject to
+the client's inbound token bucket.  A pool of worker threads calls
+process_request for each request in the work queue.
+
+Outbound messages from the MessageServer serve thread are appended to each
+client's outbound queue (the oldest message is dropped and counted when the
+queue is full) and sent by a per-client sender thread subject to the client's
+outbound token bucket.  A slow client therefore delays only its own messages.
+
+Client weights default to 1 and may be set for each new client by the
+client_weight hook or changed with ClientScheduler.set_weight.  A client is
+removed when it has disconnected and its queued requests have been dispatched.
+
+Per-client counters are returned by ClientScheduler.stats and reported every
+status_interval seconds and when a client is removed:
+
+recv/dropped/throttled:  inbound requests received, dropped (queue full), and
+                         dispatch rounds in which the client was held back by
+                         its inbound rate limit.
+sent/dropped/throttled:  outbound messages sent, dropped (queue full), and
+                         sends delayed by the outbound rate limit.
+
+DEPENDENCIES/LIMITATIONS:
+
+A rate of 0.0 disables the corresponding rate limit.  Requests from a single
+client are dispatched in order, but may be processed concurrently (and
+complete out of order) when workers > 1.
+
+"""
+
+__author__ = 'papamac'
+__version__ = '1.0.0'
+__date__ = 'October 19, 2026'
+
+from collections import deque
+from logging import DEBUG, WARNING
+from queue import Queue, Empty, Full
+from threading import Condition, Thread
+from time import monotonic, sleep
+
+from .colortext import getLogger
+
+# Global constants:
+
+LOG = getLogger('Plugin')               # Color logger.
+QUEUE_LEN = 1000                        # Default per-client queue length.
+WORKERS = 4                             # Default number of worker threads.
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter.  rate is the token refill rate (tokens/sec)
+    and burst is the bucket capacity (tokens).  rate = 0.0 is unlimited.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self._tokens = self.burst
+        self._time = monotonic()
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._time) * self.rate)
+        self._time = now
+
+    def take(self):
+        """
+        Take a token and return True if one is available; otherwise return
+        False.
+        """
+        if not self.rate:
+            return True
+        self._refill()
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+    def wait_time(self):
+        """
+        Return the time (sec) until the next token is available.
+        """
+        if not self.rate:
+            return 0.0
+        self._refill()
+        return max(0.0, (1.0 - self._tokens) / self.rate)
+
+
+class ClientQueues:
+    """
+    Inbound and outbound queues, token buckets, and counters for a single
+    MessageServer client.  Created by ClientScheduler.add_client.
+    """
+
+    # Private methods:
+
+    def __init__(self, scheduler, weight):
+        self._scheduler = scheduler
+        self._client = None
+        self.weight = weight
+        self.requests = deque()
+        self._messages = deque()
+        self._send_condition = Condition()
+        self.in_bucket = TokenBucket(scheduler.inbound_rate, scheduler.burst)
+        self._out_bucket = TokenBucket(scheduler.outbound_rate,
+                                       scheduler.burst)
+        self.name = 'client'
+        self.counts = dict.fromkeys(('recvd', 'in_dropped', 'in_throttled',
+                                     'sent', 'out_dropped', 'out_throttled'),
+                                    0)
+
+    def _send_messages(self):
+        LOG.threaddebug('ClientQueues._send_messages called "%s"', self.name)
+        while self._scheduler.running and self._client.connected:
+            with self._send_condition:
+                if not self._messages:
+                    self._send_condition.wait(1.0)
+                    continue
+                message = self._messages.popleft()
+            if not self._out_bucket.take():
+                self.counts['out_throttled'] += 1
+                sleep(self._out_bucket.wait_time())
+                self._out_bucket.take()
+            if self._client.send(message) is not None:
+                self.counts['sent'] += 1
+
+    # Public methods:
+
+    def connect(self, client):
+        """
+        Attach the connected MessageSocket, set its weight using the
+        scheduler client_weight hook (if any), and start its sender thread.
+        """
+        LOG.threaddebug('ClientQueues.connect called "%s"', client.name)
+        self._client = client
+        self.name = client.name
+        if self._scheduler.client_weight:
+            self.weight = max(1, int(self._scheduler.client_weight(self.name)))
+        sender = Thread(name=client.name + ' send', target=self._send_messages)
+        sender.daemon = True
+        sender.start()
+
+    @property
+    def connected(self):
+        return self._client is None or self._client.connected
+
+    def put_request(self, reference_name, message):
+        """
+        Queue an inbound request (MessageSocket process_message callback).
+        """
+        self.counts['recvd'] += 1
+        with self._scheduler.condition:
+            if len(self.requests) >= self._scheduler.queue_len:
+                self.counts['in_dropped'] += 1
+                return
+            self.requests.append((reference_name, message))
+            self._scheduler.condition.notify()
+
+    def put_message(self, message):
+        """
+        Queue an outbound message, dropping the oldest if the queue is full.
+        """
+        with self._send_condition:
+            if len(self._messages) >= self._scheduler.queue_len:
+                self._messages.popleft()
+                self.counts['out_dropped'] += 1
+            self._messages.append(message)
+            self._send_condition.notify()
+
+
+class ClientScheduler:
+    """
+    Per-client rate limiting and weighted round-robin dispatching of
+    MessageServer requests to a bounded pool of worker threads.
+    client_weight is an optional hook, client_weight(client_name), that
+    returns the weight (requests per round-robin visit) for a new client.
+    """
+
+    # Private methods:
+
+    def __init__(self, workers=WORKERS, queue_len=QUEUE_LEN,
+                 inbound_rate=0.0, outbound_rate=0.0, burst=None,
+                 status_interval=600.0, client_weight=None):
+        LOG.threaddebug('ClientScheduler.__init__ called')
+        self.inbound_rate = inbound_rate
+        self.outbound_rate = outbound_rate
+        self.burst = burst
+        self.queue_len = queue_len
+        self.client_weight = client_weight
+        self._workers = workers
+        self._status_interval = status_interval
+        self._process_request = None
+        self._work = Queue(maxsize=2 * workers)
+        self._clients = []
+        self._next = 0
+        self._threads = []
+        self.condition = Condition()
+        self.running = False
+
+    def _dispatch(self):
+        """
+        Move requests from the client inbound queues to the work queue in
+        weighted round-robin order, subject to the inbound rate limits.
+        """
+        LOG.threaddebug('ClientScheduler._dispatch called')
+        status_time = monotonic()
+        while self.running:
+            if monotonic() - status_time >= self._status_interval:
+                self._report()
+                status_time = monotonic()
+            dispatched = []
+            wait = 1.0
+            with self.condition:
+                self._remove_disconnected()
+                count = len(self._clients)
+                for i in range(count):
+                    client = self._clients[(self._next + i) % count]
+                    for _ in range(client.weight):
+                        if not client.requests:
+                            break
+                        if not client.in_bucket.take():
+                            client.counts['in_throttled'] += 1
+                            wait = min(wait, client.in_bucket.wait_time())
+                            break
+                        dispatched.append(client.requests.popleft())
+                self._next = self._next + 1 if self._next + 1 < count else 0
+                if not dispatched:
+                    self.condition.wait(wait)
+            while dispatched and self.running:
+                try:  # Block while the workers are busy.
+                    self._work.put(dispatched[0], timeout=1.0)
+                except Full:
+                    continue
+                dispatched.pop(0)
+
+    def _work_requests(self):
+        LOG.threaddebug('ClientScheduler._work_requests called')
+        while self.running:
+            try:
+                reference_name, message = self._work.get(timeout=1.0)
+            except Empty:
+                continue
+            try:
+                self._process_request(reference_name, message)
+            except Exception as err:
+                LOG.error('process_request exception: %s', err)
+
+    def _remove_disconnected(self):
+        """
+        Remove clients that have disconnected and have no queued requests,
+        reporting their final counters.  Called with the condition held.
+        """
+        clients = [client for client in self._clients
+                   if client.connected or client.requests]
+        if len(clients) < len(self._clients):
+            for client in self._clients:
+                if client not in clients:
+                    self._report_client(client.name, client.counts)
+            self._clients = clients
+            self._next = 0
+
+    @staticmethod
+    def _report_client(name, counts):
+        level = (WARNING if counts['in_dropped'] or counts['out_dropped']
+                 else DEBUG)
+        LOG.log(level, 'throttle "%s" in[%i %i %i] out[%i %i %i]', name,
+                counts['recvd'], counts['in_dropped'], counts['in_throttled'],
+                counts['sent'], counts['out_dropped'], counts['out_throttled'])
+
+    def _report(self):
+        for name, counts in self.stats().items():
+            self._report_client(name, counts)
+
+    # Public methods:
+
+    def start(self, process_request):
+        LOG.threaddebug('ClientScheduler.start called')
+        self._process_request = process_request
+        self.running = True
+        self._threads = [Thread(name='dispatch_requests',
+                                target=self._dispatch)]
+        for i in range(self._workers):
+            self._threads.append(Thread(name='work_requests_%i' % i,
+                                        target=self._work_requests))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        LOG.threaddebug('ClientScheduler.stop called')
+        self.running = False
+        with self.condition:
+            self.condition.notify()
+        for thread in self._threads:
+            thread.join()
+
+    def add_client(self, weight=1):
+        """
+        Create and return the ClientQueues object for a new client.
+        """
+        LOG.threaddebug('ClientScheduler.add_client called')
+        client = ClientQueues(self, weight)
+        with self.condition:
+            self._clients.append(client)
+        return client
+
+    def set_weight(self, client_name, weight):
+        """
+        Change the weight of a connected client.
+        """
+        with self.condition:
+            for client in self._clients:
+                if client.name == client_name:
+                    client.weight = max(1, int(weight))
+
+    def stats(self):
+        """
+        Return a dictionary of per-client counter dictionaries keyed by client
+        name.
+        """
+        with self.condition:
+            return {client.name: dict(client.counts)
+                    for client in self._clients}
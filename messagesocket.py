@@ -48,14 +48,20 @@ __author__ = 'papamac'
 __version__ = '1.1.1'
 __date__ = 'May 22, 2020'
 
-from binascii import crc32
+from collections import deque
 from datetime import datetime
 from logging import DEBUG, ERROR
 from math import sqrt
 from socket import *
-from threading import Thread, Lock
+from threading import Condition, Thread, Lock
+from time import sleep, time
+try:
+    from time import monotonic
+except ImportError:  # Python 2.7.
+    from time import time as monotonic
 
 from .colortext import getLogger
+from .messagecrc import CRC_FUNCTIONS, NEGOTIABLE_CRCS, crc32
 
 # Global constants:
 
@@ -72,6 +78,13 @@ SOCKET_TIMEOUT = 10.0                   # Timeout limit for socket connection,
 STATUS_INTERVAL = 600.0                 # Status reporting interval (sec).
 #                                         Also imported by the PiDACS package
 #                                         (iomgr.py)
+CTRL_PREFIX = '\x01'                    # Control message prefix (ping/pong).
+CLOCK_SYNC_INTERVAL = 10.0              # Clock sync ping interval (sec).
+CLOCK_SAMPLES = 8                       # Clock offset filter length.
+CLOCK_BASE = time() - monotonic()       # Wall clock time at monotonic zero.
+CLOCK_STEP = 0.128                      # Clock step threshold (sec).
+MAX_PENDING = 1000                      # Maximum executor pending messages.
+BATCH_SIZE = 100                        # Maximum executor batch size.
 
 
 # messagesocket module functions:
@@ -90,11 +103,65 @@ def set_status_interval(status_interval):  # Allow using modules to change the
     STATUS_INTERVAL = status_interval
 
 
+def clock():
+    """
+    Return the time in seconds since the epoch from the monotonic clock
+    anchored to the wall clock at import.  Unlike time(), clock() is not
+    stepped by NTP or manual clock changes, but it is also not corrected by
+    them.  Use it only for local intervals and ordering; times sent to peers
+    (message headers and clock sync pings) use the wall clock.
+    """
+    return CLOCK_BASE + monotonic()
+
+
+def fit_message(message):
+    """
+    Remove blanks and truncate a message to DATA_LEN encoded bytes on a
+    character boundary if necessary.
+    """
+    message = message.strip()
+    encoded = message.encode()
+    if len(encoded) > DATA_LEN:
+        LOG.warning('send: message truncated "%s"', message)
+        message = encoded[:DATA_LEN].decode('utf-8', 'ignore')
+        message = message.rstrip()  # The receiver strips blanks.
+    return message
+
+
 def next_seq(seq):
     # LOG.threaddebug('messagesocket.next_seq called')
     return seq + 1 if seq < 0xffffffff else 0
 
 
+def process_messages(process_message, reference_name, messages):
+    # Executor task that calls process_message for each message in a batch.
+    # Defined at module level so that it can be used with process pools.
+    # An exception is logged and does not discard the rest of the batch.
+    for message in messages:
+        try:
+            process_message(reference_name, message)
+        except Exception as err:
+            LOG.error('process_message exception "%s": %s %r', reference_name,
+                      err, message)
+
+
+def process_batch_messages(process_batch, reference_name, messages):
+    # Executor task that calls process_batch for a batch of messages.  If the
+    # batch raises an exception, it is logged and the batch is retried one
+    # message at a time so that only the failing messages are discarded.
+    try:
+        process_batch(reference_name, messages)
+    except Exception as err:
+        if len(messages) == 1:
+            LOG.error('process_batch exception "%s": %s %r', reference_name,
+                      err, messages[0])
+            return
+        LOG.error('process_batch exception "%s": %s; retrying %i messages '
+                  'singly', reference_name, err, len(messages))
+        for message in messages:
+            process_batch_messages(process_batch, reference_name, [message])
+
+
 class MessageSocket(Thread):
     """
     **************************** needs work ***********************************
@@ -103,16 +170,37 @@ class MessageSocket(Thread):
     # Private methods.
 
     def __init__(self, reference_name=None, disconnected=None,
-                 process_message=None, recv_timeout=0.0):
+                 process_message=None, recv_timeout=0.0, capture=None,
+                 spool=None, clock_sync=False, executor=None,
+                 process_batch=None, max_pending=MAX_PENDING,
+                 batch_size=BATCH_SIZE, crc='crc32'):
         LOG.threaddebug('MessageSocket.__init__ called')
         Thread.__init__(self, name='MessageSocket init')
         self._reference_name = reference_name
         self._disconnected = disconnected
         self._process_message = process_message
         self._recv_timeout = recv_timeout
+        self._capture = capture  # Optional MessageCapture object.
+        self._handshake = True  # Connection handshake in progress.
+        self._spool = spool  # Optional MessageSpool object.
+        self._drainer = None
+        self._drain_end = 0  # First spool seq after connection (no limit).
+        self._clock_sync = clock_sync  # Send clock sync pings if True.
+        self._clock = ClockOffset()
+        self._ping_time = 0.0
+        self._executor = executor  # Optional concurrent.futures executor.
+        self._process_batch = process_batch
+        self._max_pending = max_pending
+        self._batch_size = batch_size
+        self._pending = deque()
+        self._pending_condition = Condition()
+        self._crc_name = crc  # CRC requested by connect_to_server.
+        self._crc = crc32  # CRC in use (crc32 until negotiated).
         self._socket = None
         self._status = None
-        self._recvd_dt = datetime.now()
+        self._recvd_time = clock()  # Monotonic, for the recv timeout.
+        self._recvd_wall = time()  # Wall clock, for latency and clock sync.
+        self._send_lock = Lock()
         self._send_seq = 0
         self.connected = False
         self.running = False
@@ -147,15 +235,28 @@ class MessageSocket(Thread):
         self.connected = True
         ipv4, port_number = client_address_tuple
         self.name = '[%s:%s]' % (ipv4, port_number)
-        self._status = MessageStatus(self.name)
+        self._status = MessageStatus(self.name, self._clock, self._crc)
 
         # Receive hostname from client and add it to messagesocket name.
 
         hostname = self.recv()
         if hostname:
+            hostname, _, crc_name = hostname.partition(CTRL_PREFIX)
             self.name = hostname + self.name
             LOG.info('connected "%s"', self.name)
-            self._status = MessageStatus(self.name)
+
+            # Reply to a CRC request from the client with the CRC to use:
+            # the requested CRC if it is fast here, or crc32 otherwise.
+
+            if crc_name:
+                if crc_name not in NEGOTIABLE_CRCS:
+                    LOG.info('crc %s not available "%s"; using crc32',
+                             crc_name, self.name)
+                    crc_name = 'crc32'
+                self._send('%scrc %s' % (CTRL_PREFIX, crc_name))
+                self._crc = CRC_FUNCTIONS[crc_name]
+            self._status = MessageStatus(self.name, self._clock, self._crc)
+            self._handshake = False
         else:
             err_msg = 'connect_to_client: connection aborted "%s"' % self.name
             self._shutdown(err_msg)
@@ -195,22 +296,149 @@ class MessageSocket(Thread):
         ipv4, port = self._socket.getpeername()
         self.name = '%s[%s:%s]' % (server, ipv4, port)
         LOG.info('connected "%s"', self.name)
-        self._status = MessageStatus(self.name)
-        self.send(gethostname())
+        self._status = MessageStatus(self.name, self._clock, self._crc)
+        if self._crc_name != 'crc32' and self._crc_name not in NEGOTIABLE_CRCS:
+            LOG.info('crc %s not available "%s"; using crc32', self._crc_name,
+                     self.name)
+            self._crc_name = 'crc32'
+        if self._crc_name == 'crc32':
+            self._send(gethostname())
+        else:
+
+            # Request a different CRC and switch to the CRC in the server's
+            # reply (the requested CRC, or crc32 if it is not fast there).
+
+            self._send(gethostname() + CTRL_PREFIX + self._crc_name)
+            reply = self.recv()
+            prefix = '%scrc ' % CTRL_PREFIX
+            if reply and reply.startswith(prefix) and (
+                    reply[len(prefix):] in CRC_FUNCTIONS):
+                self._crc = CRC_FUNCTIONS[reply[len(prefix):]]
+                self._status.crc = self._crc
+            elif self.connected:
+                LOG.warning('crc request not acknowledged "%s" %s; using '
+                            'crc32', self.name, self._crc_name)
+        self._handshake = False
+
+        # Start draining spooled messages, if any.
+
+        if self._spool is not None:
+            self._drain_end = self._spool.next_seq
+            self._drainer = Thread(name=self.name + ' drain spool',
+                                   target=self._drain_spool)
+            self._drainer.daemon = True
+            self._drainer.start()
+
+    def _ping(self):
+        LOG.threaddebug('MessageSocket._ping called "%s"', self.name)
+        self._ping_time = clock()
+        self._send('%sping %.6f' % (CTRL_PREFIX, time()))
+
+    def _process_control(self, message):
+        """
+        Process clock sync control messages.  Answer a ping (t1) with a pong
+        containing t1, the ping receive time (t2), and the pong send time (t3).
+        Update the clock offset estimate when a pong is received (t4).
+        """
+        LOG.threaddebug('MessageSocket._process_control called "%s"',
+                        self.name)
+        fields = message[len(CTRL_PREFIX):].split()
+        try:
+            if fields[0] == 'ping' and len(fields) == 2:
+                pong = '%spong %s %.6f %.6f' % (CTRL_PREFIX, fields[1],
+                                                 self._recvd_wall, time())
+                self._send(pong)
+                return
+            if fields[0] == 'pong' and len(fields) == 4:
+                t1, t2, t3 = (float(field) for field in fields[1:])
+                self._clock.update(t1, t2, t3, self._recvd_wall)
+                return
+        except (IndexError, ValueError):
+            pass
+        LOG.warning('invalid control message "%s" %r', self.name, message)
+
+    def _queue_message(self, message):
+        """
+        Queue a message for the dispatch thread.  Block the recv thread if
+        max_pending messages are already queued.
+        """
+        with self._pending_condition:
+            while len(self._pending) >= self._max_pending and self.running:
+                self._pending_condition.wait(1.0)
+            self._pending.append(message)
+            self._pending_condition.notify_all()
+
+    def _dispatch_messages(self):
+        """
+        Submit queued messages to the executor in batches of up to batch_size
+        messages.  Wait for each batch to complete before submitting the next
+        one to preserve message order for this connection.  Continue until
+        the socket stops running and all queued messages are processed.
+        """
+        LOG.threaddebug('MessageSocket._dispatch_messages called "%s"',
+                        self.name)
+        while True:
+            with self._pending_condition:
+                if not self._pending:
+                    if not self.running:
+                        break
+                    self._pending_condition.wait(1.0)
+                    continue
+                count = min(len(self._pending), self._batch_size)
+                batch = [self._pending.popleft() for _ in range(count)]
+                self._pending_condition.notify_all()
+            if self._process_batch:
+                future = self._executor.submit(process_batch_messages,
+                                               self._process_batch,
+                                               self._reference_name, batch)
+            else:
+                future = self._executor.submit(process_messages,
+                                               self._process_message,
+                                               self._reference_name, batch)
+            try:
+                future.result()
+            except Exception as err:  # Executor failure (e.g., pool broken).
+                LOG.error('executor exception "%s": %s; %i messages lost',
+                          self.name, err, len(batch))
 
     def run(self):
         LOG.threaddebug('MessageSocket.run called "%s"', self.name)
         self.running = self.connected
+        dispatcher = None
+        if self._executor and (self._process_batch or self._process_message):
+            dispatcher = Thread(name=self.name + ' dispatch messages',
+                                target=self._dispatch_messages)
+            dispatcher.start()
         while self.running:
+            if (self._clock_sync
+                    and clock() - self._ping_time >= CLOCK_SYNC_INTERVAL):
+                self._ping()
             message = self.recv()
-            if message and self._process_message:
-                self._process_message(self._reference_name, message)
+            if not message:
+                continue
+            if message.startswith(CTRL_PREFIX):
+                self._process_control(message)
+            elif dispatcher:
+                self._queue_message(message)
+            elif self._process_batch:
+                process_batch_messages(self._process_batch,
+                                       self._reference_name, [message])
+            elif self._process_message:
+                process_messages(self._process_message, self._reference_name,
+                                 [message])
+        if dispatcher:
+            with self._pending_condition:
+                self._pending_condition.notify_all()
+            dispatcher.join()
 
     def stop(self):
         LOG.threaddebug('MessageSocket.stop called "%s"', self.name)
         self.running = False
         if self.is_alive():
             self.join()
+        drainer, self._drainer = self._drainer, None
+        if drainer:
+            drainer.join()
         if self.connected:
             self._socket.shutdown(SHUT_RDWR)
             self._socket.close()
@@ -232,18 +460,20 @@ class MessageSocket(Thread):
                      disconnection.
         """
         LOG.threaddebug('MessageSocket.recv called "%s"', self.name)
-        byte_msg = b''
+        byte_msg = bytearray(MSG_LEN)
+        view = memoryview(byte_msg)
         bytes_received = 0
         while bytes_received < MSG_LEN:
 
-            # Try receiving a message segment and handle exceptions.
+            # Try receiving a message segment into byte_msg and handle
+            # exceptions.
 
             try:
-                segment = self._socket.recv(MSG_LEN - bytes_received)
+                segment_len = self._socket.recv_into(view[bytes_received:])
             except timeout:
                 if not self._recv_timeout:
                     return ''
-                interval = (datetime.now() - self._recvd_dt).total_seconds()
+                interval = clock() - self._recvd_time
                 if interval < self._recv_timeout:
                     return ''
                 self._socket.shutdown(SHUT_RDWR)
@@ -258,92 +488,176 @@ class MessageSocket(Thread):
                 err_msg = 'recv: exception "%s": %s' % (self.name, err)
                 self._shutdown(err_msg)
                 return
-            if not segment:  # Null segment; peer disconnected.
+            if not segment_len:  # Null segment; peer disconnected.
                 err_msg = 'recv: disconnected "%s"' % self.name
                 self._shutdown(err_msg)
                 return
 
             # Segment received; continue.
 
-            byte_msg += segment
-            bytes_received = len(byte_msg)
+            bytes_received += segment_len
 
-        # Full-length byte_msg received.
+        # Full-length byte_msg received.  Capture it if requested, unless it
+        # is part of the connection handshake or a control message.
 
-        message = byte_msg.decode().strip()
-        self._recvd_dt = datetime.now()
-        message = self._status.recv(message, self._recvd_dt)
+        self._recvd_time = clock()
+        self._recvd_wall = time()
+        recvd_dt = datetime.fromtimestamp(self._recvd_wall)
+        message = self._status.recv(byte_msg, recvd_dt)
+        if (self._capture and not self._handshake
+                and not (message and message.startswith(CTRL_PREFIX))):
+            self._capture.write(byte_msg)
         return message  # Return the message without the header or a null
 #                         string as determined by _status.recv.
 
     def send(self, message):
         """
-        Send a fixed-length message in multiple segments.
+        Send a message, or spool it if a spool is in use and the socket is
+        disconnected or earlier spooled messages have not yet been sent.
 
-        send has two possible returns:
+        send has three possible returns:
 
         bytes_sent:  send returns the number of bytes sent if the full-length
                      message was sent without error.
+        0:           send returns 0 if the message was spooled for later
+                     sending.
         None:        send returns None if no message was sent and the socket
                      was shut down.  This happens for timeouts, socket
-                     exceptions, and segment not sent.
+                     exceptions, and segment not sent.  If a spool is in use,
+                     the message is spooled.
         """
         LOG.threaddebug('MessageSocket.send called "%s"', self.name)
+        if self._spool is None:
+            return self._send(message)
+        message = fit_message(message)  # Spool the message as it is sent.
+        if not self.connected or not self._spool.empty():
+            self._spool.put(message)
+            return 0
+        bytes_sent = self._send(message)
+        if bytes_sent is None:
+            self._spool.put(message)
+        return bytes_sent
 
-        # Remove blanks and truncate message if necessary.
-
-        message = message.strip()
-        if len(message) > DATA_LEN:
-            LOG.warning('send: message truncated "%s"', message)
-            message = message[:DATA_LEN]
-
-        # Add the crc, sequence number, and datetime to create a fixed-length
-        # byte message.
-
-        now_dt = datetime.now()
-        iso_dt = now_dt.isoformat('|')
-        if not now_dt.microsecond:
-            iso_dt += '.000000'
-        message = '%08x%s%s' % (self._send_seq, iso_dt, message)
-        crc = crc32(message.encode()) & 0xffffffff  # Works with 2.7, 3.x
-        message = '%08x%s' % (crc, message)
-        byte_msg = message.ljust(MSG_LEN).encode()
-
-        # Send the byte_msg in multiple segments.
-
-        bytes_sent = 0
-        while bytes_sent < MSG_LEN:
-
-            # Try sending a segment and handle exceptions.
-
-            try:
-                segment_bytes_sent = self._socket.send(byte_msg[bytes_sent:])
-            except timeout:
-                err_msg = 'send: timeout "%s"' % self.name
-                self._shutdown(err_msg)
-                return
-            except OSError as err:
-                err_msg = ('send: error "%s": %s' % (self.name, err))
-                self._shutdown(err_msg)
-                return
-            except Exception as err:  # Catch-all exception, just in case.
-                err_msg = ('send: exception "%s": %s' % (self.name, err))
-                self._shutdown(err_msg)
-                return
-            if not segment_bytes_sent:  # Error; segment not sent.
-                err_msg = 'send: error "%s": segment not sent' % self.name
-                self._shutdown(err_msg)
-                return
-
-            # Segment sent; continue.
-
-            bytes_sent += segment_bytes_sent
+    def _drain_spool(self):
+        """
+        Send spooled messages in sequence order.  Messages spooled before
+        the connection are sent at a rate not exceeding the spool drain_rate;
+        messages spooled after it (live messages queued behind the backlog)
+        are sent without delay so that the spool can empty.  Stop when the
+        socket is stopped or disconnected; a message that is not sent remains
+        in the spool.
+        """
+        LOG.threaddebug('MessageSocket._drain_spool called "%s"', self.name)
+        while self.connected and self._drainer:
+            spooled = self._spool.peek(timeout=1.0)
+            if spooled is None:
+                continue
+            seq, message = spooled
+            if self._send(message) is None:
+                break
+            self._spool.pop(seq)
+            if self._spool.drain_rate and seq < self._drain_end:
+                sleep(1.0 / self._spool.drain_rate)
+
+    def send_batch(self, messages):
+        """
+        Send multiple messages as a single block of contiguous fixed-length
+        messages.  Return values are the same as for send, except that
+        bytes_sent is the total for all messages.
+        """
+        LOG.threaddebug('MessageSocket.send_batch called "%s"', self.name)
+        if self._spool is None:
+            return self._send_block(messages)
+        messages = [fit_message(message) for message in messages]
+        if not self.connected or not self._spool.empty():
+            for message in messages:
+                self._spool.put(message)
+            return 0
+        bytes_sent = self._send_block(messages)
+        if bytes_sent is None:
+            for message in messages:
+                self._spool.put(message)
+        return bytes_sent
 
-        # Full-length byte_msg sent.
+    def _send(self, message):
+        """
+        Send a fixed-length message.  Return the number of bytes sent, or None
+        if the socket was shut down (see send).
+        """
+        return self._send_block([message])
 
-        self._status.send()
-        self._send_seq = next_seq(self._send_seq)
-        return bytes_sent
+    def _send_block(self, messages):
+        """
+        Encode one or more messages into a block of contiguous fixed-length
+        byte messages and send the block in multiple segments.  Each message
+        is encoded once; its CRC is computed over a slice of the block.
+        Return the number of bytes sent, or None if the socket was shut down.
+        """
+        LOG.threaddebug('MessageSocket._send_block called "%s"', self.name)
+
+        data = [fit_message(message) for message in messages]
+        block_len = MSG_LEN * len(data)
+
+        # Serialize sends from multiple threads (e.g., clock sync pongs sent
+        # by the recv thread).
+
+        with self._send_lock:
+
+            # Add the crc, sequence number, and datetime to each message to
+            # create fixed-length byte messages in a blank-filled block.
+
+            byte_msgs = bytearray(b' ' * block_len)
+            view = memoryview(byte_msgs)
+            now_dt = datetime.now()
+            iso_dt = now_dt.isoformat('|')
+            if not now_dt.microsecond:
+                iso_dt += '.000000'
+            send_seq = self._send_seq
+            for index, message in enumerate(data):
+                start = index * MSG_LEN
+                body = ('%08x%s%s' % (send_seq, iso_dt, message)).encode()
+                end = start + CRC_LEN + len(body)
+                byte_msgs[start + CRC_LEN:end] = body
+                crc = self._crc(view[start + CRC_LEN:end]) & 0xffffffff
+                byte_msgs[start:start + CRC_LEN] = ('%08x' % crc).encode()
+                send_seq = next_seq(send_seq)
+
+            # Send the block in multiple segments.
+
+            bytes_sent = 0
+            while bytes_sent < block_len:
+
+                # Try sending a segment and handle exceptions.
+
+                try:
+                    segment_bytes_sent = self._socket.send(view[bytes_sent:])
+                except timeout:
+                    err_msg = 'send: timeout "%s"' % self.name
+                    self._shutdown(err_msg)
+                    return
+                except OSError as err:
+                    err_msg = ('send: error "%s": %s' % (self.name, err))
+                    self._shutdown(err_msg)
+                    return
+                except Exception as err:  # Catch-all exception, just in case.
+                    err_msg = ('send: exception "%s": %s' % (self.name, err))
+                    self._shutdown(err_msg)
+                    return
+                if not segment_bytes_sent:  # Error; segment not sent.
+                    err_msg = 'send: error "%s": segment not sent' % self.name
+                    self._shutdown(err_msg)
+                    return
+
+                # Segment sent; continue.
+
+                bytes_sent += segment_bytes_sent
+
+            # Full-length block sent.
+
+            for _ in data:
+                self._status.send()
+            self._send_seq = send_seq
+            return bytes_sent
 
 
 class MessageStatus:
@@ -353,9 +667,11 @@ class MessageStatus:
 
     # Private methods:
 
-    def __init__(self, name):
+    def __init__(self, name, clock_offset=None, crc=crc32):
         LOG.threaddebug('MessageStatus.__init__ called "%s"', name)
         self._name = name
+        self.crc = crc  # CRC function (see messagecrc).
+        self._clock = clock_offset  # Optional ClockOffset object.
         self._lock = Lock()
         self._min = None
         self._max = None
@@ -365,6 +681,7 @@ class MessageStatus:
     def _init(self):
         LOG.threaddebug('MessageStatus._init called "%s"', self._name)
         self._shorts = self._crc_errs = self._dt_errs = self._seq_errs = 0
+        self._decode_errs = 0
         self._recvd = self._sent = 0
         self._min = 1000000.0
         self._max = self._sum = self._sum2 = 0.0
@@ -383,14 +700,20 @@ class MessageStatus:
                 std = (sqrt(self._sum2 / self._recvd - avg * avg)
                        if self._recvd else 0.0)
                 recv_rate = self._recvd / interval
-                recv_status = ('recv[%i %i %i %i|%i %i %i %i|%i %i]'
+                recv_status = ('recv[%i %i %i %i %i|%i %i %i %i|%i %i]'
                                % (self._shorts, self._crc_errs, self._dt_errs,
-                                  self._seq_errs, min_, self._max, avg, std,
-                                  self._recvd, recv_rate))
+                                  self._seq_errs, self._decode_errs, min_,
+                                  self._max, avg, std, self._recvd,
+                                  recv_rate))
                 send_rate = self._sent / interval
                 send_status = 'send[%i %i]' % (self._sent, send_rate)
+                if self._clock and self._clock.rtt is not None:
+                    send_status += (' clock[%.1f %.1f]'
+                                    % (1000.0 * self._clock.offset,
+                                       1000.0 * self._clock.rtt))
                 errs = (self._shorts + self._crc_errs + self._dt_errs +
-                        self._seq_errs or self._max > 1000.0 * SOCKET_TIMEOUT)
+                        self._seq_errs + self._decode_errs
+                        or self._max > 1000.0 * SOCKET_TIMEOUT)
                 level = ERROR if errs else DEBUG
                 LOG.log(level, 'status "%s" %s %s', self._name, recv_status,
                         send_status)
@@ -398,25 +721,35 @@ class MessageStatus:
 
     # Public methods.
 
-    def recv(self, message, recvd_dt):
+    def recv(self, byte_msg, recvd_dt):
         """
-        Check the message header for short messages, crc errors, datetime
-        errors, and sequence errors.  Update error and status data and call the
-        _report method for status reporting.  Return the message without the
-        header if no errors are found, or a null message otherwise (soft
-        error).
+        Check the fixed-length byte message for short messages, crc errors,
+        UTF-8 decode errors, datetime errors, and sequence errors.  Update
+        error and status data and call the _report method for status
+        reporting.  Return the decoded message without the header if no
+        errors are found, or a null message otherwise (soft error).
         """
         LOG.threaddebug('MessageStatus.recv called "%s"', self._name)
-        if len(message) < HDR_LEN:  # Check for short message.
+        end = len(byte_msg.rstrip())
+        if end < HDR_LEN:  # Check for short message.
             self._shorts += 1
             self._report()
             return ''
-        crc_msg = int(message[:CRC_LEN], 16)  # Check for CRC error.
-        crc_calc = crc32(message.encode()[CRC_LEN:]) & 0xffffffff  # 2.7 & 3.x
+        try:  # Check for CRC error; compute the CRC over a slice of byte_msg.
+            crc_msg = int(byte_msg[:CRC_LEN], 16)
+        except ValueError:
+            crc_msg = None
+        crc_calc = self.crc(memoryview(byte_msg)[CRC_LEN:end]) & 0xffffffff
         if crc_msg != crc_calc:
             self._crc_errs += 1
             self._report()
             return ''
+        try:  # Check for decode error.
+            message = byte_msg[:end].decode()
+        except UnicodeDecodeError:
+            self._decode_errs += 1
+            self._report()
+            return ''
         try:  # Check for datetime error.
             msg_dt = datetime.strptime(message[HEX_LEN:HDR_LEN],
                                        '%Y-%m-%d|%H:%M:%S.%f')
@@ -435,6 +768,8 @@ class MessageStatus:
         self._recvd += 1
         self._recv_seq = next_seq(self._recv_seq)
         latency = 1000.0 * (recvd_dt - msg_dt).total_seconds()
+        if self._clock:  # Correct for the peer clock offset.
+            latency += 1000.0 * self._clock.offset
         self._min = min(latency, self._min)
         self._max = max(latency, self._max)
         self._sum += latency
@@ -448,6 +783,47 @@ class MessageStatus:
         self._report()
 
 
+class ClockOffset:
+    """
+    NTP-style estimate of a peer's clock offset (peer clock - local clock) and
+    the round-trip time (sec) from ping/pong exchanges using wall clock
+    times.  The estimate is taken from the minimum round-trip time sample of
+    the last CLOCK_SAMPLES exchanges (NTP clock filter).  The samples are
+    discarded when either clock steps by more than CLOCK_STEP (e.g., an NTP
+    step after boot), so the estimate follows the step immediately.
+    """
+
+    # Private methods:
+
+    def __init__(self):
+        self._lock = Lock()
+        self._samples = deque(maxlen=CLOCK_SAMPLES)
+        self.offset = 0.0
+        self.rtt = None
+        self._base = time() - monotonic()
+
+    # Public methods:
+
+    def update(self, t1, t2, t3, t4):
+        """
+        Add a sample given the ping send time (t1, local), ping receive time
+        (t2, peer), pong send time (t3, peer), and pong receive time (t4,
+        local).
+        """
+        offset = ((t2 - t1) + (t3 - t4)) / 2.0
+        rtt = (t4 - t1) - (t3 - t2)
+        base = time() - monotonic()
+        with self._lock:
+            local_step = abs(base - self._base) > CLOCK_STEP
+            peer_step = (self._samples
+                         and abs(offset - self.offset) > CLOCK_STEP + rtt)
+            if local_step or peer_step:
+                self._samples.clear()
+            self._base = base
+            self._samples.append((rtt, offset))
+            self.rtt, self.offset = min(self._samples)
+
+
 class MessageServer:
     """
     **************************** needs work ***********************************
@@ -455,7 +831,9 @@ class MessageServer:
 
     # Private methods:
 
-    def __init__(self, port_number, get_message=None, process_request=None):
+    def __init__(self, port_number, get_message=None, process_request=None,
+                 capture=None, clock_sync=False, scheduler=None,
+                 executor=None, process_batch=None):
         LOG.threaddebug('MessageServer.__init__ called')
         self._socket = socket(AF_INET, SOCK_STREAM)
         self._socket.settimeout(SOCKET_TIMEOUT)
@@ -463,16 +841,27 @@ class MessageServer:
         self._socket.bind(('', port_number))
         self._get_message = get_message
         self._process_request = process_request
+        self._capture = capture
+        self._clock_sync = clock_sync
+        self._scheduler = scheduler  # Optional ClientScheduler object.
+        self._executor = executor  # Optional concurrent.futures executor.
+        self._process_batch = process_batch
         self._accept = Thread(name='accept_client_connections',
                               target=self._accept_client_connections)
         self._serve = Thread(name='serve_clients',
                              target=self._serve_clients)
         self._clients = []
+        self._queues = {}
         self.running = False
 
     def start(self):
         LOG.threaddebug('MessageServer.start called')
         self.running = True
+        if self._scheduler:
+            process_request = self._process_request
+            if self._process_batch and not process_request:
+                process_request = self._process_batch_request
+            self._scheduler.start(process_request)
         self._accept.start()
         self._serve.start()
 
@@ -482,6 +871,20 @@ class MessageServer:
         self._serve.join()
         for client in self._clients:
             client.stop()
+        if self._scheduler:
+            self._scheduler.stop()
+
+    def client_stats(self):
+        """
+        Return per-client rate limiting counters (see ClientScheduler.stats),
+        or an empty dictionary if no scheduler is in use.
+        """
+        return self._scheduler.stats() if self._scheduler else {}
+
+    def _process_batch_request(self, reference_name, message):
+        # Scheduler workers dispatch single requests; pass each one to
+        # process_batch as a one-message batch.
+        self._process_batch(reference_name, [message])
 
     def _accept_client_connections(self):
         LOG.threaddebug('MessageServer._accept_client_connections called')
@@ -490,15 +893,44 @@ class MessageServer:
         name = '%s[%s:%s]' % (gethostname(), ipv4, port)
         LOG.info('accepting client connections "%s"', name)
         while self.running:
+            self._remove_disconnected()
             try:
                 client_socket, client_address_tuple = self._socket.accept()
             except timeout:
                 continue
-            client = MessageSocket(name, process_message=self._process_request)
+            queues = None
+            process_message = self._process_request
+            process_batch = self._process_batch
+            executor = self._executor
+            if self._scheduler:
+                queues = self._scheduler.add_client()
+                process_message = queues.put_request
+                process_batch = None
+                executor = None  # The scheduler has its own worker threads.
+            client = MessageSocket(name, process_message=process_message,
+                                   capture=self._capture,
+                                   clock_sync=self._clock_sync,
+                                   executor=executor,
+                                   process_batch=process_batch)
             client.connect_to_client(client_socket, client_address_tuple)
             client.start()
+            if queues:
+                queues.connect(client)
+                self._queues[client] = queues
             self._clients.append(client)
 
+    def _remove_disconnected(self):
+        """
+        Drop disconnected clients (and their ClientQueues) so that they are
+        no longer served or retained.
+        """
+        clients = [client for client in self._clients if client.connected]
+        if len(clients) < len(self._clients):
+            self._queues = {client: queues
+                            for client, queues in self._queues.items()
+                            if client.connected}
+            self._clients = clients
+
     def _serve_clients(self):
         LOG.threaddebug('MessageServer._serve_clients called')
         while self.running:
@@ -506,4 +938,7 @@ class MessageServer:
             if message:
                 for client in self._clients:
                     if client.running:
-                        client.send(message)
+                        if client in self._queues:
+                            self._queues[client].put_message(message)
+                        else:
+                            client.send(message)
@@ -0,0 +1,318 @@
+"""
+ PACKAGE:  papamac's common module library (papamaclib)
+  MODULE:  messagespool.py
+   TITLE:  messagesocket store-and-forward spool (messagespool)
+FUNCTION:  Provides a durable outbound message spool that stores messages
+           while a MessageSocket is disconnected and drains them in sequence
+           order after reconnection.
+   USAGE:  A MessageSpool object is passed to MessageSocket (spool argument).
+           The same MessageSpool object should be passed to each new
+           MessageSocket that reconnects to the same server.  It is compatible
+           with all versions of Python 3.x.
+  AUTHOR:  papamac
+ VERSION:  1.0.0
+    DATE:  October 19, 2026
+
+
+MIT LICENSE:
+
+Copyright (c) 2018-2026 David A. Krause, aka papamac
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+DESCRIPTION:
+
+The spool is a directory of append-only segment files named by the spool
+sequence number of their first record (e.g., 0000000000000000.spool).  Each
+record is a little-endian uint64 sequence number, a uint16 message length, and
+the UTF-8 encoded message.  New records are appended to the last (tail)
+segment, and a new segment is started when the next record would make the tail
+larger than segment_bytes.
+Appended records are flushed immediately and fsync'ed in batches (every
+fsync_count records or fsync_interval seconds, whichever comes first).  A
+timer armed by put performs the interval fsync, so a partial batch is synced
+even while no messages are being drained (e.g., while disconnected).
+
+Messages are drained from the first (head) segment in sequence order.  The
+drain_rate limit applies only to messages spooled before a connection is
+made; messages spooled after it are drained without delay so that live
+traffic does not wait behind the throttled backlog.  A
+segment file is deleted when all of its records have been sent.  When the
+total spool size exceeds max_bytes, the oldest segments are evicted and their
+unsent messages are counted and logged as lost.  segment_bytes must be less
+than max_bytes so that evicting all segments but the tail keeps the spool
+within max_bytes.
+
+DEPENDENCIES/LIMITATIONS:
+
+Drain progress within a segment is not persisted.  If the program stops
+while a segment is partially drained, that segment is resent in its entirety
+after restart (at-least-once delivery).
+
+"""
+
+__author__ = 'papamac'
+__version__ = '1.0.0'
+__date__ = 'October 19, 2026'
+
+from collections import deque
+from os import fsync
+from pathlib import Path
+from struct import Struct
+from threading import Condition, Timer
+from time import time
+
+from .colortext import getLogger
+
+# Global constants:
+
+LOG = getLogger('Plugin')               # Color logger.
+REC_HDR = Struct('<QH')                 # Record sequence number and length.
+MAX_BYTES = 64 * 1024 * 1024            # Default maximum spool size (bytes).
+SEGMENT_BYTES = 4 * 1024 * 1024         # Default segment file size (bytes).
+FSYNC_COUNT = 100                       # Default records per fsync.
+FSYNC_INTERVAL = 1.0                    # Default maximum fsync delay (sec).
+
+
+class _Segment:
+    """
+    Segment file bookkeeping: path, first sequence number, number of records,
+    and size (bytes).
+    """
+
+    def __init__(self, path, first, count=0, size=0):
+        self.path = path
+        self.first = first
+        self.count = count
+        self.size = size
+
+
+class MessageSpool:
+    """
+    Durable, bounded, append-only outbound message spool.  drain_rate is the
+    maximum rate (messages/sec) at which MessageSocket drains the messages
+    spooled before reconnection; drain_rate = 0.0 drains as fast as
+    possible.
+    """
+
+    # Private methods:
+
+    def __init__(self, directory, max_bytes=MAX_BYTES,
+                 segment_bytes=SEGMENT_BYTES, fsync_count=FSYNC_COUNT,
+                 fsync_interval=FSYNC_INTERVAL, drain_rate=0.0):
+        LOG.threaddebug('MessageSpool.__init__ called "%s"', directory)
+        if segment_bytes >= max_bytes:
+
+            # Eviction removes whole segments other than the tail, so the
+            # size limit can only be kept if a segment is smaller than it.
+
+            raise ValueError('segment_bytes (%i) must be less than max_bytes '
+                             '(%i)' % (segment_bytes, max_bytes))
+        self._dir = Path(directory)
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._segment_bytes = segment_bytes
+        self._fsync_count = fsync_count
+        self._fsync_interval = fsync_interval
+        self.drain_rate = drain_rate
+        self._condition = Condition()
+        self._segments = deque()
+        self._seq = 0
+        self._count = 0                 # Number of unsent messages.
+        self._bytes = 0                 # Total segment file size (bytes).
+        self._tail = None               # Tail segment file (append).
+        self._unsynced = 0
+        self._synced = time()
+        self._sync_timer = None         # Interval fsync timer.
+        self._head = None               # Head segment file (read).
+        self._head_offset = 0
+        self._head_read = 0
+        self._peeked = None             # (seq, next_offset) of peeked record.
+        self.evicted = 0
+        self._recover()
+
+    def _recover(self):
+        """
+        Rebuild the segment list from existing segment files, truncating a
+        partially written final record if necessary.
+        """
+        LOG.threaddebug('MessageSpool._recover called "%s"', self._dir)
+        for path in sorted(self._dir.glob('*.spool')):
+            segment = _Segment(path, int(path.stem, 16))
+            with open(path, 'r+b') as file:
+                while True:
+                    hdr = file.read(REC_HDR.size)
+                    if len(hdr) < REC_HDR.size:
+                        break
+                    seq, length = REC_HDR.unpack(hdr)
+                    if len(file.read(length)) < length:
+                        break
+                    segment.count += 1
+                    segment.size += REC_HDR.size + length
+                    self._seq = seq + 1
+                file.truncate(segment.size)
+            if segment.count:
+                self._segments.append(segment)
+                self._count += segment.count
+                self._bytes += segment.size
+            else:
+                path.unlink()
+        if self._count:
+            LOG.info('recovered %i spooled messages "%s"', self._count,
+                     self._dir)
+
+    def _sync(self):
+        if self._tail and self._unsynced:
+            fsync(self._tail.fileno())
+        self._unsynced = 0
+        self._synced = time()
+
+    def _timed_sync(self):
+        with self._condition:
+            self._sync_timer = None
+            if self._unsynced:
+                self._sync()
+
+    def _close_tail(self):
+        if self._tail:
+            self._sync()
+            self._tail.close()
+            self._tail = None
+
+    def _close_head(self):
+        if self._head:
+            self._head.close()
+            self._head = None
+        self._head_offset = self._head_read = 0
+        self._peeked = None
+
+    def _remove_head_segment(self):
+        segment = self._segments.popleft()
+        self._close_head()
+        if not self._segments:
+            self._close_tail()
+        segment.path.unlink()
+        self._bytes -= segment.size
+        return segment
+
+    def _evict(self):
+        lost = self._segments[0].count - self._head_read
+        self._remove_head_segment()
+        self._count -= lost
+        self.evicted += lost
+        LOG.warning('spool full; %i messages evicted "%s"', lost, self._dir)
+
+    # Public methods:
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def next_seq(self):
+        """
+        Sequence number of the next message to be spooled.
+        """
+        return self._seq
+
+    def empty(self):
+        return not self._count
+
+    def put(self, message):
+        """
+        Append a message to the spool, fsync if the batch is complete, and
+        evict the oldest segments if the spool is full.
+        """
+        LOG.threaddebug('MessageSpool.put called "%s"', self._dir)
+        data = message.encode()
+        record = REC_HDR.pack(self._seq, len(data)) + data
+        with self._condition:
+            if (not self._tail or self._segments[-1].size + len(record)
+                    > self._segment_bytes):
+                self._close_tail()
+                path = self._dir / ('%016x.spool' % self._seq)
+                self._tail = open(path, 'ab')
+                self._segments.append(_Segment(path, self._seq))
+            self._tail.write(record)
+            self._tail.flush()
+            segment = self._segments[-1]
+            segment.count += 1
+            segment.size += len(record)
+            self._seq += 1
+            self._count += 1
+            self._bytes += len(record)
+            self._unsynced += 1
+            if (self._unsynced >= self._fsync_count
+                    or time() - self._synced >= self._fsync_interval):
+                self._sync()
+            elif not self._sync_timer:
+                self._sync_timer = Timer(self._fsync_interval,
+                                         self._timed_sync)
+                self._sync_timer.daemon = True
+                self._sync_timer.start()
+            while self._bytes > self._max_bytes and len(self._segments) > 1:
+                self._evict()
+            self._condition.notify()
+
+    def peek(self, timeout=None):
+        """
+        Return the (seq, message) tuple for the oldest unsent message without
+        removing it, or None if the spool is still empty after waiting timeout
+        seconds.
+        """
+        with self._condition:
+            if not self._count:
+                self._condition.wait(timeout)
+                if not self._count:
+                    return None
+            segment = self._segments[0]
+            if not self._head:
+                self._head = open(segment.path, 'rb')
+            self._head.seek(self._head_offset)
+            seq, length = REC_HDR.unpack(self._head.read(REC_HDR.size))
+            message = self._head.read(length).decode()
+            self._peeked = seq, self._head.tell()
+            return seq, message
+
+    def pop(self, seq):
+        """
+        Remove the message returned by the last peek after it has been sent.
+        Ignore the pop if the message was evicted in the meantime.
+        """
+        with self._condition:
+            if not self._peeked or self._peeked[0] != seq:
+                return
+            self._head_offset = self._peeked[1]
+            self._peeked = None
+            self._head_read += 1
+            self._count -= 1
+            if self._head_read == self._segments[0].count:
+                self._remove_head_segment()
+
+    def close(self):
+        LOG.threaddebug('MessageSpool.close called "%s"', self._dir)
+        with self._condition:
+            if self._sync_timer:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+            self._close_tail()
+            self._close_head()
+        if self._count:
+            LOG.info('%i messages remain spooled "%s"', self._count,
+                     self._dir)
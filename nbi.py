@@ -5,8 +5,7 @@
 FUNCTION:  nbi provides a class and methods to incorporate non-blocking command
            line input into main programs.
    USAGE:  nbi is imported and used within main programs (e.g., msg-c and
-           msg-s).  It is compatible with Python 2.7.16 and all versions of
-           Python 3.x.
+           msg-s).  It is compatible with Python 3.5 and later versions.
   AUTHOR:  papamac
  VERSION:  1.0.2
     DATE:  May 20, 2020
@@ -49,8 +48,22 @@ __author__ = 'papamac'
 __version__ = '1.0.2'
 __date__ = 'May 20, 2020'
 
-from queue import Queue, Empty
-from threading import Thread
+from codecs import getincrementaldecoder
+from collections import deque
+from os import close, pipe, read, write
+from queue import Queue, Empty, Full
+from selectors import DefaultSelector, EVENT_READ
+import sys
+from threading import Event, Thread, Lock
+
+from .colortext import getLogger
+
+# Global constants:
+
+LOG = getLogger('Plugin')               # Color logger.
+BUFFER_LEN = 1000                       # Maximum number of buffered lines.
+READ_LEN = 65536                        # Maximum bytes per stdin read.
+FULL_WAIT = 0.1                         # Retry interval when buffer is full.
 
 
 class NBI(Thread):
@@ -58,26 +71,181 @@ class NBI(Thread):
     **************************** needs work ***********************************
     """
 
-    _queue = Queue()
+    _queue = Queue(maxsize=BUFFER_LEN)
+    _callbacks = []
+    _futures = deque()
+    _lock = Lock()
+    _stopping = Event()
+    _wakeup = None
+    eof = False
 
-    # Private method:
+    # Private methods:
+
+    @classmethod
+    def _deliver(cls, lines):
+        """
+        Deliver a batch of input lines, each one to the oldest pending
+        asyncio future if any, otherwise to the registered callbacks if any,
+        otherwise to the bounded buffer (waiting while the buffer is full).
+        The destination is chosen and the line is buffered while holding
+        _lock so that get_future cannot miss a line.  Return False if stop
+        is called while waiting for the buffer.
+        """
+        for line in lines:
+            while True:
+                future = None
+                callbacks = []
+                with cls._lock:
+                    while cls._futures and cls._futures[0][1].done():
+                        cls._futures.popleft()  # Discard cancelled futures.
+                    if cls._futures:
+                        future = cls._futures.popleft()
+                    elif cls._callbacks:
+                        callbacks = list(cls._callbacks)
+                    else:
+                        try:
+                            cls._queue.put_nowait(line)
+                            break
+                        except Full:
+                            pass
+                if future or callbacks:
+                    break
+                if cls._stopping.wait(FULL_WAIT):
+                    return False
+            if future:
+                loop, future = future
+                loop.call_soon_threadsafe(cls._set_result, future, line)
+            for callback in callbacks:
+                cls._call(callback, line)
+        return True
+
+    @staticmethod
+    def _call(callback, line):
+        try:
+            callback(line)
+        except Exception as err:  # Don't let a callback kill the nbi thread.
+            LOG.error('nbi callback exception: %s', err)
+
+    @staticmethod
+    def _set_result(future, line):
+        if not future.done():
+            future.set_result(line)
 
     @classmethod
     def _run(cls):
-        while True:
-            cls._queue.put(input())
+        """
+        Wait for stdin to become readable and read all available input in a
+        single read.  Deliver complete lines (without line endings) as a
+        batch and keep any partial line for the next read.  Close the wakeup
+        pipe when the reader exits.
+        """
+        wakeup = cls._wakeup
+        try:
+            cls._read_lines(wakeup[0])
+        finally:
+            with cls._lock:
+                if cls._wakeup is wakeup:
+                    cls._wakeup = None
+                close(wakeup[0])
+                close(wakeup[1])
+
+    @classmethod
+    def _read_lines(cls, wakeup_fd):
+        fd = sys.stdin.fileno()
+        decoder = getincrementaldecoder(sys.stdin.encoding or 'utf-8')(
+            errors='replace')
+        partial = ''
+        with DefaultSelector() as selector:
+            selector.register(wakeup_fd, EVENT_READ)
+            try:
+                selector.register(fd, EVENT_READ)
+            except (OSError, ValueError):  # Regular file; always readable.
+                selector = None
+            while True:
+                if selector:
+                    events = selector.select()
+                    if any(key.fd == wakeup_fd for key, _ in events):
+                        break
+                data = read(fd, READ_LEN)
+                if not data:  # End of file.
+                    if partial:
+                        cls._deliver([partial.rstrip('\r')])
+                    cls.eof = True
+                    break
+                lines = (partial + decoder.decode(data)).split('\n')
+                partial = lines.pop()
+                if not cls._deliver([line.rstrip('\r') for line in lines]):
+                    break
 
     # Public methods:
 
     @classmethod
     def start(cls):
+        cls._stopping.clear()
+        cls._wakeup = pipe()
         _nbi = Thread(name='nbi', target=cls._run, daemon=True)
         _nbi.start()
 
     @classmethod
-    def get_input(cls):
+    def stop(cls):
+        cls._stopping.set()  # Wakes a reader waiting for the buffer.
+        with cls._lock:
+            if cls._wakeup:  # Reader still running; wake it.
+                write(cls._wakeup[1], b'x')
+
+    @classmethod
+    def add_callback(cls, callback):
+        """
+        Call callback(line) in the nbi thread for each input line as soon as
+        it arrives.  Lines already buffered are delivered first.
+        """
+        with cls._lock:
+            cls._callbacks.append(callback)
+            lines = cls.get_batch()
+        for line in lines:
+            cls._call(callback, line)
+
+    @classmethod
+    def remove_callback(cls, callback):
+        with cls._lock:
+            cls._callbacks.remove(callback)
+
+    @classmethod
+    def get_future(cls, loop):
+        """
+        Return an asyncio future on loop that is resolved with the next input
+        line as soon as it arrives.
+        """
+        future = loop.create_future()
+        with cls._lock:
+            try:
+                future.set_result(cls._queue.get_nowait())
+            except Empty:
+                cls._futures.append((loop, future))
+        return future
+
+    @classmethod
+    def get_input(cls, timeout=1):
+        """
+        Return the next input line, waiting up to timeout seconds for one to
+        arrive (timeout=0 does not wait; timeout=None waits indefinitely), or
+        None if there is no input.
+        """
         try:
-            data = cls._queue.get(timeout=1)
+            data = (cls._queue.get_nowait() if timeout == 0
+                    else cls._queue.get(timeout=timeout))
         except Empty:
             data = None
         return data
+
+    @classmethod
+    def get_batch(cls):
+        """
+        Return a list of all buffered input lines without waiting.
+        """
+        lines = []
+        while True:
+            try:
+                lines.append(cls._queue.get_nowait())
+            except Empty:
+                return lines